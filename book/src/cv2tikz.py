@@ -13,164 +13,208 @@
 import json
 import sys
 
+from collections import deque
+
 scope_by_name = {}
 scope_name_by_id = {}
 
+# The circuit elements, indexed by element id, with the indices of all their
+# nodes, the function to update their output node states and the indices of
+# their input and output nodes (in the order expected by this function).
+elements = []
+nodes_by_element_id = []
+update_function_by_element_id = []
+ports_by_element_id = []
 
-def update_subcircuit(element, all_nodes):
-    i = all_nodes[element['inputNodes'][0]].get('state')
-    c = all_nodes[element['inputNodes'][1]].get('state')
-    output = all_nodes[element['outputNodes'][0]]
-    if 'NormallyClosed' in scope_name_by_id[element['id']]:
-        if i != None and c != 1:
-            output['state'] = i
-    elif i != None and c == 1:
-        output['state'] = i
 
+def update_normally_open_relay(ports, states):
+    input, control, output = ports
+    i = states[input]
+    if i is not None and states[control] == 1:
+        states[output] = i
 
-def maybe_update_subcircuit_input(element, all_nodes):
-    input = all_nodes[element['inputNodes'][0]]
-    c = all_nodes[element['inputNodes'][1]].get('state')
-    o = all_nodes[element['outputNodes'][0]].get('state')
-    if 'NormallyClosed' in scope_name_by_id[element['id']]:
-        if o != None and c != 1:
-            input['state'] = o
-    elif o != None and c == 1:
-        input['state'] = o
 
+def update_normally_closed_relay(ports, states):
+    input, control, output = ports
+    i = states[input]
+    if i is not None and states[control] != 1:
+        states[output] = i
 
-def update_and_gate(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
-    if len(nodes['inp']) != 2:
-        raise Exception(f'Unsupported and gate (>2 inputs)')
-    output = all_nodes[nodes['output1']]
-    if i0 != None or i1 != None:
-        output['state'] = 1 if i0 == 1 and i1 == 1 else 0
-
-
-def update_demultiplexer(nodes, all_nodes):
-    i = all_nodes[nodes['input']].get('state')
-    c = all_nodes[nodes['controlSignalInput']].get('state')
-    output0 = all_nodes[nodes['output1'][0]]
-    output1 = all_nodes[nodes['output1'][1]]
-    if i != None and c != None:
+
+def maybe_update_normally_open_relay_input(ports, states):
+    input, control, output = ports
+    o = states[output]
+    if o is not None and states[control] == 1:
+        states[input] = o
+
+
+def maybe_update_normally_closed_relay_input(ports, states):
+    input, control, output = ports
+    o = states[output]
+    if o is not None and states[control] != 1:
+        states[input] = o
+
+
+# The function to update the input node state of a relay from its output
+# node state, indexed by the function doing the reverse update.
+input_update_functions = {
+    update_normally_open_relay: maybe_update_normally_open_relay_input,
+    update_normally_closed_relay: maybe_update_normally_closed_relay_input,
+}
+
+
+def update_and_gate(ports, states):
+    input0, input1, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    if i0 is not None or i1 is not None:
+        states[output] = 1 if i0 == 1 and i1 == 1 else 0
+
+
+def update_demultiplexer(ports, states):
+    input, control, output0, output1 = ports
+    i = states[input]
+    c = states[control]
+    if i is not None and c is not None:
         if c == 0:
-            output0['state'] = i
-            output1['state'] = 0
+            states[output0] = i
+            states[output1] = 0
         else:
-            output0['state'] = 0
-            output1['state'] = i
+            states[output0] = 0
+            states[output1] = i
 
 
-def update_multiplexer(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
-    if len(nodes['inp']) != 2:
-        raise Exception(f'Unsupported multiplexer (>2 inputs)')
-    c = all_nodes[nodes['controlSignalInput']].get('state')
-    output = all_nodes[nodes['output1']]
-    if c != None:
-        if c == 0 and i0 != None:
-            output['state'] = i0
-        elif i1 != None:
-            output['state'] = i1
-
-
-def update_nand_gate(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
-    if len(nodes['inp']) != 2:
-        raise Exception(f'Unsupported nand gate (>2 inputs)')
-    output = all_nodes[nodes['output1']]
-    if i0 != None or i1 != None:
-        output['state'] = 0 if i0 == 1 and i1 == 1 else 1
+def update_multiplexer(ports, states):
+    input0, input1, control, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    c = states[control]
+    if c is not None:
+        if c == 0 and i0 is not None:
+            states[output] = i0
+        elif i1 is not None:
+            states[output] = i1
 
 
-def update_nor_gate(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
-    if len(nodes['inp']) != 2:
-        raise Exception(f'Unsupported nor gate (>2 inputs)')
-    output = all_nodes[nodes['output1']]
-    if i0 != None or i1 != None:
-        output['state'] = 0 if i0 == 1 or i1 == 1 else 1
-
-
-def update_not_gate(nodes, all_nodes):
-    i = all_nodes[nodes['inp1']].get('state')
-    output = all_nodes[nodes['output1']]
-    if i != None:
-        output['state'] = 1 if i == 0 else 0
-
-
-def update_or_gate(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
-    if len(nodes['inp']) == 3:
-        i2 = all_nodes[nodes['inp'][2]].get('state')
-        output = all_nodes[nodes['output1']]
-        if i0 != None or i1 != None or i2 != None:
-            output['state'] = 1 if i0 == 1 or i1 == 1 or i2 == 1 else 0
-    else:
-        if len(nodes['inp']) != 2:
-            raise Exception(f'Unsupported or gate (>3 inputs)')
-        output = all_nodes[nodes['output1']]
-        if i0 != None or i1 != None:
-            output['state'] = 1 if i0 == 1 or i1 == 1 else 0
+def update_nand_gate(ports, states):
+    input0, input1, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    if i0 is not None or i1 is not None:
+        states[output] = 0 if i0 == 1 and i1 == 1 else 1
+
+
+def update_nor_gate(ports, states):
+    input0, input1, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    if i0 is not None or i1 is not None:
+        states[output] = 0 if i0 == 1 or i1 == 1 else 1
 
 
-def update_sr_flip_flop(nodes, all_nodes):
-    i = all_nodes[nodes['S']].get('state')
-    output = all_nodes[nodes['qOutput']]
-    output['state'] = 1 if i == 1 else 0
+def update_not_gate(ports, states):
+    input, output = ports
+    i = states[input]
+    if i is not None:
+        states[output] = 1 if i == 0 else 0
 
 
-def update_tristate(nodes, all_nodes):
-    i = all_nodes[nodes['inp1']].get('state')
-    c = all_nodes[nodes['state']].get('state')
-    output = all_nodes[nodes['output1']]
-    if i != None and c != None:
-        output['state'] = i if c == 1 else None
+def update_or_gate(ports, states):
+    input0, input1, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    if i0 is not None or i1 is not None:
+        states[output] = 1 if i0 == 1 or i1 == 1 else 0
 
 
-def update_xor_gate(nodes, all_nodes):
-    i0 = all_nodes[nodes['inp'][0]].get('state')
-    i1 = all_nodes[nodes['inp'][1]].get('state')
+def update_or3_gate(ports, states):
+    input0, input1, input2, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    i2 = states[input2]
+    if i0 is not None or i1 is not None or i2 is not None:
+        states[output] = 1 if i0 == 1 or i1 == 1 or i2 == 1 else 0
+
+
+def update_sr_flip_flop(ports, states):
+    input, output = ports
+    i = states[input]
+    states[output] = 1 if i == 1 else 0
+
+
+def update_tristate(ports, states):
+    input, control, output = ports
+    i = states[input]
+    c = states[control]
+    if i is not None and c is not None:
+        states[output] = i if c == 1 else None
+
+
+def update_xor_gate(ports, states):
+    input0, input1, output = ports
+    i0 = states[input0]
+    i1 = states[input1]
+    if i0 is not None or i1 is not None:
+        states[output] = 1 if (i0 == 1) != (i1 == 1) else 0
+
+
+# Returns an update function which raises an exception. Unsupported elements
+# are only rejected if they are updated, i.e., if their output state is not
+# initialized by initialize_node_states.
+def unsupported_update_function(name):
+    def update_unsupported_element(ports, states):
+        raise Exception(f'Unsupported {name}')
+    return update_unsupported_element
+
+
+def two_input_gate(update_function, nodes, name):
     if len(nodes['inp']) != 2:
-        raise Exception(f'Unsupported xor gate (>2 inputs)')
-    output = all_nodes[nodes['output1']]
-    if i0 != None or i1 != None:
-        output['state'] = 1 if (i0 == 1) != (i1 == 1) else 0
+        return (unsupported_update_function(f'{name} (>2 inputs)'), ())
+    return (update_function, (nodes['inp'][0], nodes['inp'][1], nodes['output1']))
 
 
-def update_element(element, all_nodes):
-    type = element.get('objectType')
+def get_update_function_and_ports(e):
+    type = e.get('objectType')
     if type is None:
-        update_subcircuit(element, all_nodes)
-        return
-    nodes = element['customData']['nodes']
+        is_relay, normally_closed, _, _ = e['relayFlags']
+        if not is_relay:
+            return (None, ())
+        ports = (e['inputNodes'][0], e['inputNodes'][1], e['outputNodes'][0])
+        if normally_closed:
+            return (update_normally_closed_relay, ports)
+        return (update_normally_open_relay, ports)
+    nodes = e['customData']['nodes']
     match type:
         case 'AndGate':
-            update_and_gate(nodes, all_nodes)
+            return two_input_gate(update_and_gate, nodes, 'and gate')
         case 'Demultiplexer':
-            update_demultiplexer(nodes, all_nodes)
+            return (update_demultiplexer, (nodes['input'], nodes['controlSignalInput'],
+                                           nodes['output1'][0], nodes['output1'][1]))
         case 'Multiplexer':
-            update_multiplexer(nodes, all_nodes)
+            if len(nodes['inp']) != 2:
+                return (unsupported_update_function('multiplexer (>2 inputs)'), ())
+            return (update_multiplexer, (nodes['inp'][0], nodes['inp'][1],
+                                         nodes['controlSignalInput'], nodes['output1']))
         case 'NandGate':
-            update_nand_gate(nodes, all_nodes)
+            return two_input_gate(update_nand_gate, nodes, 'nand gate')
         case 'NorGate':
-            update_nor_gate(nodes, all_nodes)
+            return two_input_gate(update_nor_gate, nodes, 'nor gate')
         case 'NotGate':
-            update_not_gate(nodes, all_nodes)
+            return (update_not_gate, (nodes['inp1'], nodes['output1']))
         case 'OrGate':
-            update_or_gate(nodes, all_nodes)
+            if len(nodes['inp']) == 3:
+                return (update_or3_gate, (nodes['inp'][0], nodes['inp'][1],
+                                          nodes['inp'][2], nodes['output1']))
+            if len(nodes['inp']) != 2:
+                return (unsupported_update_function('or gate (>3 inputs)'), ())
+            return two_input_gate(update_or_gate, nodes, 'or gate')
         case 'SRflipFlop':
-            update_sr_flip_flop(nodes, all_nodes)
+            return (update_sr_flip_flop, (nodes['S'], nodes['qOutput']))
         case 'TriState':
-            update_tristate(nodes, all_nodes)
+            return (update_tristate, (nodes['inp1'], nodes['state'], nodes['output1']))
         case 'XorGate':
-            update_xor_gate(nodes, all_nodes)
+            return two_input_gate(update_xor_gate, nodes, 'xor gate')
+    return (None, ())
 
 
 INPUT_NODE = 0
@@ -178,139 +222,169 @@ OUTPUT_NODE = 1
 
 
 def element_nodes(e):
+    if e.get('objectType') is None:
+        return tuple(e['inputNodes'] + e['outputNodes'])
     nodes = []
     for value in e['customData']['nodes'].values():
         if type(value) is list:
-            for index in value:
-                nodes.append(index)
+            nodes.extend(value)
         else:
             nodes.append(value)
-    return nodes
+    return tuple(nodes)
 
 
-def initialize_node_states(e, all_nodes, element_by_node_index):
+# Adds an element to the element arrays, and stores its id for all its nodes.
+def register_element(e, element_id_by_node_index):
+    element_id = len(elements)
+    update_function, ports = get_update_function_and_ports(e)
+    elements.append(e)
+    nodes_by_element_id.append(element_nodes(e))
+    update_function_by_element_id.append(update_function)
+    ports_by_element_id.append(ports)
+    for node in nodes_by_element_id[element_id]:
+        element_id_by_node_index[node] = element_id
+
+
+def initialize_node_states(e, states):
     type = e.get('objectType')
     if type is None:
-        name = scope_name_by_id[e['id']]
-        for input in e['inputNodes']:
-            element_by_node_index[input] = e
-        for output in e['outputNodes']:
-            element_by_node_index[output] = e
-            if not 'Normally' in name:
-                all_nodes[output]['state'] = 0
+        if not e['relayFlags'][0]:
+            for output in e['outputNodes']:
+                states[output] = 0
         return
-    for node in element_nodes(e):
-        element_by_node_index[node] = e
     nodes = e['customData']['nodes']
     match type:
         case 'Clock' | 'Ground':
-            all_nodes[nodes['output1']]['state'] = 0
+            states[nodes['output1']] = 0
         case 'Button' | 'Input':
             state = e['customData']['values']['state']
-            all_nodes[nodes['output1']]['state'] = state
+            states[nodes['output1']] = state
         case 'Power':
-            all_nodes[nodes['output1']]['state'] = 1
+            states[nodes['output1']] = 1
         case 'DflipFlop':
             # Hack to show D flip flops with custom initial states.
             if e['labelDirection'] == 'UP':
-                all_nodes[nodes['qOutput']]['state'] = 1
+                states[nodes['qOutput']] = 1
             else:
-                all_nodes[nodes['qOutput']]['state'] = 0
+                states[nodes['qOutput']] = 0
         case 'NorGate' | 'NotGate':
             # Hack to manually break cycles in flip flop circuits.
             if e['labelDirection'] == 'UP':
-                all_nodes[nodes['output1']]['state'] = 1
+                states[nodes['output1']] = 1
             elif e['labelDirection'] == 'DOWN':
-                all_nodes[nodes['output1']]['state'] = 0
-
-
-def find_successors(index, nodes, successors, visited):
-    visited[index] = True
-    for successor_index in nodes[index]['connections']:
-        if not visited[successor_index]:
-            if nodes[successor_index]['type'] != OUTPUT_NODE:
-                successors.add(successor_index)
-            find_successors(successor_index, nodes, successors, visited)
-
-
-def topological_sort(index, successors_by_node_index, sorted_nodes, node_status):
-    if node_status[index] == 2:
-        return
-    if node_status[index] == 1:
-        raise Exception('Cyclic graph!')
-    node_status[index] = 1
-    for successor_index in successors_by_node_index[index]:
-        topological_sort(
-            successor_index, successors_by_node_index, sorted_nodes, node_status)
-    node_status[index] = 2
-    sorted_nodes.append(index)
-
-
-def compute_node_states(nodes, element_by_node_index):
-    successors_by_node_index = [None] * len(nodes)
-    for (index, node) in enumerate(nodes):
-        visited = [False] * len(nodes)
+                states[nodes['output1']] = 0
+
+
+def find_root(parents, index):
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def find_net_successors(connections_by_node_index, types):
+    # Connections are symmetric, so the nodes reachable from a node via wires
+    # are those of its connected component, or 'net'. Compute the nets with a
+    # union-find structure, and return the set of non output nodes of the net
+    # of each node. Nodes in the same net share the same set.
+    parents = list(range(len(types)))
+    for (index, connections) in enumerate(connections_by_node_index):
+        for connection in connections:
+            root = find_root(parents, index)
+            connection_root = find_root(parents, connection)
+            if root != connection_root:
+                parents[connection_root] = root
+    successors_by_root = {}
+    for (index, node_type) in enumerate(types):
+        if node_type != OUTPUT_NODE:
+            root = find_root(parents, index)
+            successors_by_root.setdefault(root, set()).add(index)
+    return [successors_by_root.get(find_root(parents, index), set())
+            for index in range(len(types))]
+
+
+def compute_node_states(connections_by_node_index, types, states,
+                        element_id_by_node_index):
+    successors_by_node_index = [None] * len(types)
+    net_successors = find_net_successors(connections_by_node_index, types)
+    for (index, node_type) in enumerate(types):
         successors = set()
-        if node['type'] == INPUT_NODE:
-            element = element_by_node_index[index]
-            if element:
+        if node_type == INPUT_NODE:
+            element_id = element_id_by_node_index[index]
+            if element_id is not None:
+                element = elements[element_id]
                 if element.get('objectType') is None:
-                    name = scope_name_by_id[element['id']]
-                    for output in element['outputNodes']:
-                        if 'Normally' in name:
-                            successors.add(output)
+                    if element['relayFlags'][0]:
+                        successors.update(element['outputNodes'])
                 else:
-                    for n in element_nodes(element):
-                        if nodes[n]['type'] == OUTPUT_NODE and nodes[n].get('state') is None:
+                    for n in nodes_by_element_id[element_id]:
+                        if types[n] == OUTPUT_NODE and states[n] is None:
                             successors.add(n)
-        elif node['type'] == OUTPUT_NODE:
-            find_successors(index, nodes, successors, visited)
+        elif node_type == OUTPUT_NODE:
+            successors = net_successors[index]
         successors_by_node_index[index] = successors
 
+    # Visit the nodes in topological order with Kahn's algorithm, and
+    # propagate the node states as soon as each node is visited.
+    predecessor_count = [0] * len(types)
+    for successors in successors_by_node_index:
+        for successor_index in successors:
+            predecessor_count[successor_index] += 1
+    queue = deque(index for (index, count) in enumerate(predecessor_count)
+                  if count == 0)
     sorted_nodes = []
-    node_status = [0] * len(nodes)
-    for (index, node) in enumerate(nodes):
-        if node_status[index] == 0:
-            topological_sort(index, successors_by_node_index,
-                             sorted_nodes, node_status)
+    while queue:
+        index = queue.popleft()
+        sorted_nodes.append(index)
+        if types[index] == OUTPUT_NODE:
+            element_id = element_id_by_node_index[index]
+            if element_id is not None and states[index] is None:
+                update_function = update_function_by_element_id[element_id]
+                if update_function:
+                    update_function(ports_by_element_id[element_id], states)
+            state = states[index]
+            if state is not None:
+                for successor_index in successors_by_node_index[index]:
+                    states[successor_index] = state
+        for successor_index in successors_by_node_index[index]:
+            predecessor_count[successor_index] -= 1
+            if predecessor_count[successor_index] == 0:
+                queue.append(successor_index)
+    if len(sorted_nodes) != len(types):
+        raise Exception('Cyclic graph!')
 
     for index in reversed(sorted_nodes):
-        node = nodes[index]
-        if node['type'] != OUTPUT_NODE:
-            continue
-        element = element_by_node_index[index]
-        if element and node.get('state') is None:
-            update_element(element, nodes)
-        state = node.get('state')
-        if state != None:
-            for successor_index in successors_by_node_index[index]:
-                nodes[successor_index]['state'] = state
-
-    for index in sorted_nodes:
-        node = nodes[index]
-        if node.get('state') is not None:
+        if states[index] is not None:
             continue
-        for connection in node.get('connections'):
-            state = nodes[connection].get('state')
-            if state != None:
-                node['state'] = state
+        for connection in connections_by_node_index[index]:
+            state = states[connection]
+            if state is not None:
+                states[index] = state
                 break
-        if node['type'] == OUTPUT_NODE:
-            element = element_by_node_index[index]
-            if element and element.get('objectType') is None:
-                maybe_update_subcircuit_input(element, nodes)
+        if types[index] == OUTPUT_NODE:
+            element_id = element_id_by_node_index[index]
+            if element_id is not None:
+                input_update_function = input_update_functions.get(
+                    update_function_by_element_id[element_id])
+                if input_update_function:
+                    input_update_function(ports_by_element_id[element_id], states)
 
 
 src = open(sys.argv[1], "r")
-data = json.load(src)
+text = src.read()
 src.close()
-
-dst = open(sys.argv[1], "w")
-json.dump(data, dst, indent=0)
-dst.close()
-
-tikz = open(sys.argv[2], "w")
-tikz.write(
+data = json.loads(text)
+
+# Rewrite the input file in canonical form, but only if it is not already.
+canonical_text = json.dumps(data, indent=0)
+if canonical_text != text:
+    dst = open(sys.argv[1], "w")
+    dst.write(canonical_text)
+    dst.close()
+
+# The TikZ output lines, written to the output file at the end of main().
+tikz = []
+tikz.append(
     '\\begin{tikzpicture}[x=0.15mm,y=-0.15mm,inner sep=0pt,outer sep=0pt,line width=0.45mm]\n')
 
 bounding_box = [float('inf'), float('inf'), -float('inf'), -float('inf')]
@@ -322,31 +396,34 @@ if len(sys.argv) > 3:
 UNKNOWN = 'red0'
 OFF = 'violet2'
 ON = 'green2'
+color_by_state = {None: UNKNOWN, 0: OFF, 1: ON}
 
+# The TikZ commands used for each node and each connection.
+NODE_FORMAT = '\\path[fill=%s] (%s,%s) circle[radius=3];\n'
+CONNECTION_FORMAT = '\\path[draw=%s] (%s,%s) -- (%s,%s);\n'
 
-def rotation(direction):
-    match direction:
-        case 'UP':
-            return '[rotate=90] '
-        case 'LEFT':
-            return '[rotate=180] '
-        case 'DOWN':
-            return '[rotate=-90] '
-        case _:
-            return ''
 
+rotation_by_direction = {
+    'UP': '[rotate=90] ',
+    'LEFT': '[rotate=180] ',
+    'DOWN': '[rotate=-90] ',
+}
 
-def transform(node, x0, y0, direction):
+# The (a, b, c, d) coefficients of the 2x2 matrix [[a, b], [c, d]] which
+# transforms the node coordinates of an element with the given direction.
+matrix_by_direction = {
+    'UP': (0, 1, -1, 0),
+    'LEFT': (-1, 0, 0, 1),
+    'DOWN': (0, 1, 1, 0),
+}
+IDENTITY = (1, 0, 0, 1)
+
+
+def transform(node, x0, y0, matrix):
     x, y = node['x'], node['y']
-    match direction:
-        case 'UP':
-            (x, y) = (y, -x)
-        case 'LEFT':
-            (x, y) = (-x, y)
-        case 'DOWN':
-            (x, y) = (y, x)
-    node['x'] = x0 + x
-    node['y'] = y0 + y
+    a, b, c, d = matrix
+    node['x'] = x0 + a * x + b * y
+    node['y'] = y0 + c * x + d * y
 
 
 def update_bounding_box(x, y):
@@ -356,62 +433,64 @@ def update_bounding_box(x, y):
     bounding_box[3] = max(bounding_box[3], y)
 
 
-def convert_subcircuit(e, all_nodes):
+def convert_subcircuit(e, all_nodes, states):
     x, y = e['x'], e['y']
     for index in e['inputNodes']:
-        transform(all_nodes[index], x, y, 'RIGHT')
+        transform(all_nodes[index], x, y, IDENTITY)
     for index in e['outputNodes']:
-        transform(all_nodes[index], x, y, 'RIGHT')
-    name = scope_name_by_id[e['id']]
-    if not 'Normally' in name:
+        transform(all_nodes[index], x, y, IDENTITY)
+    is_relay, _, normally_open, right = e['relayFlags']
+    if not is_relay:
+        name = scope_name_by_id[e['id']]
         layout = scope_by_name[name]['layout']
         dx = layout['width']
         dy = layout['height']
-        tikz.write(f'\\path[draw=black] ({x}, {y}) rectangle +({dx}, {dy});\n')
-        tikz.write(
+        tikz.append(f'\\path[draw=black] ({x}, {y}) rectangle +({dx}, {dy});\n')
+        tikz.append(
             f'\\node[cv_font,anchor=center,black] at ({x+dx/2},{y+dy/2}){{{name}}};\n')
         return
-    normally_open = 'NormallyOpen' in name
-    input = all_nodes[e['inputNodes'][0]].get('state')
-    active = all_nodes[e['inputNodes'][1]].get('state') == 1
+    input = states[e['inputNodes'][0]]
+    active = states[e['inputNodes'][1]] == 1
     if active == normally_open:
-        if input == None:
+        if input is None:
             input = UNKNOWN
         else:
             input = ON if input == 1 else OFF
     else:
         input = 'black'
     coil = 'yellow2' if active else 'black'
-    if '-right' in name:
-        tikz.write(
+    if right:
+        tikz.append(
             f'\\begin{{scope}}[rotate around={{-90:({x+10},{y+10})}}]\n')
-    tikz.write(f'\\path[fill={coil}] ({x}, {y+4}) rectangle +(4.5, 12);\n')
-    tikz.write(f'\\path[draw=black] ({x}, {y}) rectangle +(30, 20);\n')
+    tikz.append(f'\\path[fill={coil}] ({x}, {y+4}) rectangle +(4.5, 12);\n')
+    tikz.append(f'\\path[draw=black] ({x}, {y}) rectangle +(30, 20);\n')
     if normally_open:
         if active:
-            tikz.write(
+            tikz.append(
                 f'\\path[draw={input},line cap=round] ({x+12}, {y+3}) -- +(0, 14);\n')
-            tikz.write(f'\\path[draw={input}] ({x+9}, {y+5}) -- +(0, 10);\n')
+            tikz.append(f'\\path[draw={input}] ({x+9}, {y+5}) -- +(0, 10);\n')
         else:
-            tikz.write(
+            tikz.append(
                 f'\\path[draw={input},line cap=round] ({x+20}, {y+3}) -- +(0, 14);\n')
-            tikz.write(f'\\path[draw={input}] ({x+17}, {y+5}) -- +(0, 10);\n')
+            tikz.append(f'\\path[draw={input}] ({x+17}, {y+5}) -- +(0, 10);\n')
     else:
         if active:
-            tikz.write(
+            tikz.append(
                 f'\\path[draw={input},line cap=round] ({x+10}, {y+3}) -- +(0, 14);\n')
-            tikz.write(f'\\path[draw={input}] ({x+7}, {y+5}) -- +(0, 10);\n')
+            tikz.append(f'\\path[draw={input}] ({x+7}, {y+5}) -- +(0, 10);\n')
         else:
-            tikz.write(
+            tikz.append(
                 f'\\path[draw={input},line cap=round] ({x+18}, {y+3}) -- +(0, 14);\n')
-            tikz.write(f'\\path[draw={input}] ({x+15}, {y+5}) -- +(0, 10);\n')
-    if '-right' in name:
-        tikz.write('\\end{scope}\n')
+            tikz.append(f'\\path[draw={input}] ({x+15}, {y+5}) -- +(0, 10);\n')
+    if right:
+        tikz.append('\\end{scope}\n')
 
 
-def convert_circuit_element(e, pic, all_nodes):
+def convert_circuit_element(e, pic, all_nodes, states):
     x, y = e['x'], e['y']
     direction = e['direction']
+    matrix = matrix_by_direction.get(direction, IDENTITY)
+    rotation = rotation_by_direction.get(direction, '')
     nodes = e['customData']['nodes']
     for key, value in nodes.items():
         match key:
@@ -419,70 +498,71 @@ def convert_circuit_element(e, pic, all_nodes):
                   'input' | 'input1' | 'output1' | 'qOutput' | 'R' | 'S' | 'state'):
                 if type(value) is list:
                     for index in value:
-                        transform(all_nodes[index], x, y, direction)
+                        transform(all_nodes[index], x, y, matrix)
                 else:
-                    transform(all_nodes[value], x, y, direction)
+                    transform(all_nodes[value], x, y, matrix)
             case _:
                 all_nodes[value].clear()
     if x < xrange[0] or x > xrange[1]:
         return
-    if pic == 'DigitalLed' and all_nodes[nodes['inp1']].get('state') == 1:
-        tikz.write(
-            f'\\pic at ({x},{y}) {rotation(direction)}{{DigitalLedOn}};\n')
-    elif pic == 'Output' and all_nodes[nodes['inp1']].get('state') is None:
-        tikz.write(f'\\pic at ({x},{y}) {rotation(direction)}{{OutputX}};\n')
+    if pic == 'DigitalLed' and states[nodes['inp1']] == 1:
+        tikz.append(
+            f'\\pic at ({x},{y}) {rotation}{{DigitalLedOn}};\n')
+    elif pic == 'Output' and states[nodes['inp1']] is None:
+        tikz.append(f'\\pic at ({x},{y}) {rotation}{{OutputX}};\n')
     else:
-        tikz.write(f'\\pic at ({x},{y}) {rotation(direction)}{{{pic}}};\n')
+        tikz.append(f'\\pic at ({x},{y}) {rotation}{{{pic}}};\n')
     if e['objectType'] == 'Input':
         state = e['customData']['values']['state']
-        tikz.write(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
+        tikz.append(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
     elif e['objectType'] == 'Output':
-        state = all_nodes[nodes['inp1']].get('state')
-        if state == None:
+        state = states[nodes['inp1']]
+        if state is None:
             state = 'X'
-        tikz.write(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
+        tikz.append(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
     elif e['objectType'] == 'DflipFlop' or e['objectType'] == 'SRflipFlop':
-        state = all_nodes[nodes['qOutput']].get('state')
-        tikz.write(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
+        state = states[nodes['qOutput']]
+        tikz.append(f'\\node[cv_font,anchor=center] at ({x},{y}){{{state}}};\n')
 
 
-def convert_node(node):
-    x, y = node['x'], node['y']
-    update_bounding_box(x, y)
-    if x < xrange[0] or x > xrange[1]:
+def convert_nodes(nodes, states):
+    xmin, xmax = xrange
+    nodes_and_states = [(node, state) for (node, state) in zip(nodes, states) if node]
+    if not nodes_and_states:
         return
-    color = UNKNOWN
-    state = node.get('state')
-    if state == 0:
-        color = OFF
-    elif state == 1:
-        color = ON
-    if node['type'] == 2:
-        tikz.write(f'\\path[fill={color}] ({x},{y}) circle[radius=3];\n')
-    else:
-        tikz.write(f'\\path[fill={OFF}] ({x},{y}) circle[radius=3];\n')
-
-
-def convert_connections(index, node, nodes):
-    x, y = node['x'], node['y']
-    color = UNKNOWN
-    state = node.get('state')
-    if state == 0:
-        color = OFF
-    elif state == 1:
-        color = ON
-    for connection in node['connections']:
-        if index < connection:
-            other = nodes[connection]
-            x0, y0 = x, y
-            x1, y1 = other['x'], other['y']
-            if x0 > x1:
-                (x0, y0), (x1, y1) = (x1, y1), (x0, y0)
-            if x1 < xrange[0] or x0 > xrange[1]:
-                continue
-            x0 = max(xrange[0], min(xrange[1], x0))
-            x1 = max(xrange[0], min(xrange[1], x1))
-            tikz.write(f'\\path[draw={color}] ({x0},{y}) -- ({x1},{y1});\n')
+    xs = [node['x'] for (node, _) in nodes_and_states]
+    ys = [node['y'] for (node, _) in nodes_and_states]
+    update_bounding_box(min(xs), min(ys))
+    update_bounding_box(max(xs), max(ys))
+    tikz.extend(
+        NODE_FORMAT % (color_by_state.get(state, UNKNOWN) if node['type'] == 2 else OFF,
+                       node['x'], node['y'])
+        for (node, state) in nodes_and_states if xmin <= node['x'] <= xmax)
+
+
+def convert_connections(nodes, states):
+    write = tikz.append
+    xmin, xmax = xrange
+    # Clipping is only needed when an x range is specified.
+    clip = xmin != -float('inf')
+    for (index, node) in enumerate(nodes):
+        if not node:
+            continue
+        x, y = node['x'], node['y']
+        color = color_by_state.get(states[index], UNKNOWN)
+        for connection in node['connections']:
+            if index < connection:
+                other = nodes[connection]
+                x0 = x
+                x1, y1 = other['x'], other['y']
+                if x0 > x1:
+                    x0, x1, y1 = x1, x0, y
+                if clip:
+                    if x1 < xmin or x0 > xmax:
+                        continue
+                    x0 = max(xmin, min(xmax, x0))
+                    x1 = max(xmin, min(xmax, x1))
+                write(CONNECTION_FORMAT % (color, x0, y, x1, y1))
 
 
 def convert_annotation(element):
@@ -493,8 +573,8 @@ def convert_annotation(element):
         update_bounding_box(x, y)
         update_bounding_box(x + dx, y + dy)
         if x >= xrange[0] and x <= xrange[1]:
-            tikz.write('\\path[draw=black,dash pattern=on 0.6mm off 0.9mm,'
-                       f'line width=0.3mm,line cap=round] ({x},{y}) rectangle +({dx},{dy});\n')
+            tikz.append('\\path[draw=black,dash pattern=on 0.6mm off 0.9mm,'
+                        f'line width=0.3mm,line cap=round] ({x},{y}) rectangle +({dx},{dy});\n')
         return
     if x < xrange[0] or x > xrange[1]:
         return
@@ -516,14 +596,34 @@ def convert_annotation(element):
             case 'DOWN':
                 anchor = 'base'
                 y = y + 30
-        tikz.write(
+        tikz.append(
             f'\\node[cv_font,anchor={anchor},baseline,color=black] at ({x},{y}) {{{label}}};\n')
     else:
         label = element['label']
-        tikz.write(
+        tikz.append(
             f'\\node[cv_font,anchor=base west,baseline,color=black] at ({x},{y}) {{{label}}};\n')
 
 
+SUPPORTED = frozenset({
+    'AndGate', 'Button', 'Clock', 'Demultiplexer', 'DflipFlop', 'DigitalLed',
+    'Ground', 'Input', 'Multiplexer', 'NandGate', 'NorGate', 'NotGate', 'OrGate',
+    'Output', 'Power', 'SRflipFlop', 'SubCircuit', 'TriState', 'XorGate'})
+IGNORED = frozenset({
+    'layout', 'verilogMetadata', 'allNodes', 'id', 'name', 'Text',
+    'Rectangle', 'restrictedCircuitElementsUsed', 'nodes'})
+
+
+def circuit_element_converter(pic):
+    return lambda e, all_nodes, states: convert_circuit_element(e, pic, all_nodes, states)
+
+
+# The function to convert each supported element type to TikZ.
+convert_function_by_type = {
+    type: convert_subcircuit if type == 'SubCircuit' else circuit_element_converter(type)
+    for type in SUPPORTED
+}
+
+
 def main():
     for scope in data['scopes']:
         id = str(scope['id'])
@@ -532,32 +632,34 @@ def main():
         scope_name_by_id[id] = name
     scope = scope_by_name['Main']
     nodes = scope['allNodes']
-    supported = {'AndGate', 'Button', 'Clock', 'Demultiplexer', 'DflipFlop', 'DigitalLed',
-                 'Ground', 'Input', 'Multiplexer', 'NandGate', 'NorGate', 'NotGate', 'OrGate',
-                 'Output', 'Power', 'SRflipFlop', 'SubCircuit', 'TriState', 'XorGate'}
-    ignored = {'layout', 'verilogMetadata', 'allNodes', 'id', 'name', 'Text',
-               'Rectangle', 'restrictedCircuitElementsUsed', 'nodes'}
-    element_by_node_index = [None] * len(nodes)
+    # Store the node types, connections and states in arrays indexed by node
+    # index, to avoid dictionary lookups when computing the node states.
+    types = [node['type'] for node in nodes]
+    connections_by_node_index = [node['connections'] for node in nodes]
+    states = [None] * len(nodes)
+    element_id_by_node_index = [None] * len(nodes)
+    # Compute the subcircuit name properties once for all. Subcircuits named
+    # 'Normally...' are relays, drawn with a custom symbol.
+    for e in scope.get('SubCircuit', []):
+        name = scope_name_by_id[e['id']]
+        e['relayFlags'] = ('Normally' in name, 'NormallyClosed' in name,
+                           'NormallyOpen' in name, '-right' in name)
     for key, value in scope.items():
-        if key in supported:
+        if key in SUPPORTED:
             for element in value:
-                initialize_node_states(element, nodes, element_by_node_index)
-    compute_node_states(nodes, element_by_node_index)
+                register_element(element, element_id_by_node_index)
+                initialize_node_states(element, states)
+    compute_node_states(connections_by_node_index, types,
+                        states, element_id_by_node_index)
     for key, value in scope.items():
-        if key in supported:
+        if key in SUPPORTED:
+            convert_function = convert_function_by_type[key]
             for element in value:
-                if key == 'SubCircuit':
-                    convert_subcircuit(element, nodes)
-                else:
-                    convert_circuit_element(element, key, nodes)
-        elif key not in ignored:
+                convert_function(element, nodes, states)
+        elif key not in IGNORED:
             raise Exception(f'Unsupported element {key}')
-    for (index, node) in enumerate(nodes):
-        if node:
-            convert_connections(index, node, nodes)
-    for node in nodes:
-        if node:
-            convert_node(node)
+    convert_connections(nodes, states)
+    convert_nodes(nodes, states)
     for key, value in scope.items():
         if key in {'Input', 'Output', 'Rectangle', 'Text'}:
             for element in value:
@@ -565,10 +667,12 @@ def main():
     if xrange[0] != -float('inf'):
         bounding_box[0] = max(bounding_box[0], xrange[0])
         bounding_box[2] = min(bounding_box[2], xrange[1])
-        tikz.write(f'\\useasboundingbox ({bounding_box[0]},{bounding_box[1]}) '
-                   f'rectangle ({bounding_box[2]},{bounding_box[3]});\n')
-    tikz.write('\\end{tikzpicture}\n')
-    tikz.close()
+        tikz.append(f'\\useasboundingbox ({bounding_box[0]},{bounding_box[1]}) '
+                    f'rectangle ({bounding_box[2]},{bounding_box[3]});\n')
+    tikz.append('\\end{tikzpicture}\n')
+    dst = open(sys.argv[2], "w")
+    dst.write(''.join(tikz))
+    dst.close()
 
 
 main()
@@ -14,6 +14,7 @@ import math
 import re
 import sys
 
+from functools import lru_cache
 from lxml import etree
 from types import SimpleNamespace
 
@@ -28,7 +29,24 @@ consts.PATH = '{http://www.w3.org/2000/svg}path'
 consts.RECT = '{http://www.w3.org/2000/svg}rect'
 consts.TEXT = '{http://www.w3.org/2000/svg}text'
 
+ROTATE_REGEX = re.compile(r'rotate\((-?\d+)\)')
+# The kind of each path command, depending on its coordinates.
+POINT = 0
+HORIZONTAL = 1
+VERTICAL = 2
+COMMAND_KINDS = {
+    'M': POINT, 'm': POINT, 'L': POINT, 'l': POINT, 'C': POINT, 'c': POINT,
+    'H': HORIZONTAL, 'h': HORIZONTAL, 'V': VERTICAL, 'v': VERTICAL,
+}
+ROTATIONS = frozenset({'rotate(-45)', 'rotate(45)'})
+# The attributes which are removed because they have their default value.
+DEFAULT_ATTRIBUTES = frozenset({('fill', '#000000'), ('fill-opacity', '1'),
+                                ('stroke', 'none'), ('stroke-opacity', '1'),
+                                ('text-anchor', 'start')})
+GEOMETRY_KEYS = frozenset({'x', 'y', 'width', 'height', 'cx', 'cy', 'rx', 'ry', 'r'})
+
 
+@lru_cache(maxsize=4096)
 def check_round(value, base, allow_tenth=False):
     rounded_value = round(value / base) * base
     if not abs(rounded_value - value) < 0.05 * base:
@@ -42,6 +60,7 @@ def check_round(value, base, allow_tenth=False):
     return rounded_value
 
 
+@lru_cache(maxsize=2048)
 def format(value):
     if abs(value - int(value)) < 1e-6:
         return f'{int(value)}'
@@ -49,31 +68,99 @@ def format(value):
 
 
 def simplify_path_data(path):
-    tokens = path.split(' ')
     new_tokens = []
-    command = None
-    for token in tokens:
+    kind = None
+    for token in path.split(' '):
         if len(token) == 1 and token[0].isalpha():
-            command = token
-            new_tokens.append(command)
+            new_tokens.append(token)
+            kind = COMMAND_KINDS.get(token)
+        elif kind == POINT:
+            coords = token.split(',')
+            x = check_round(float(coords[0]), 1, allow_tenth=True)
+            y = check_round(float(coords[1]), 1, allow_tenth=True)
+            new_tokens.append(f'{format(x)},{format(y)}')
+        elif kind == HORIZONTAL or kind == VERTICAL:
+            x = check_round(float(token), 1, allow_tenth=True)
+            new_tokens.append(f'{format(x)}')
         else:
-            match command:
-                case 'M' | 'm' | 'L' | 'l' | 'C' | 'c':
-                    coords = token.split(',')
-                    x = check_round(float(coords[0]), 1, allow_tenth=True)
-                    y = check_round(float(coords[1]), 1, allow_tenth=True)
-                    new_tokens.append(f'{format(x)},{format(y)}')
-                case 'H' | 'h' | 'V' | 'v':
-                    x = check_round(float(token), 1, allow_tenth=True)
-                    new_tokens.append(f'{format(x)}')
-                case _:
-                    raise NotImplementedError(path)
+            raise NotImplementedError(path)
     return ' '.join(new_tokens)
 
 
+# Returns a function which keeps a style property as an attribute, unless it
+# has the given default value.
+def keep_style_unless(default_value):
+    def simplify_style(element, name, value):
+        if value != default_value:
+            element.set(name, value)
+    return simplify_style
+
+
+# Returns a function which removes a style property, and checks that it has the
+# given (and only supported) value.
+def require_style(supported_value):
+    def simplify_style(element, name, value):
+        if value != supported_value:
+            raise NotImplementedError(name, value)
+    return simplify_style
+
+
+def ignore_style(element, name, value):
+    pass
+
+
+def simplify_font_size_style(element, name, value):
+    value = float(value.removesuffix('px'))
+    if value != 3.9:
+        element.set(name, f'{value}px')
+
+
+def simplify_marker_style(element, name, value):
+    element.set(name, 'url(#arrow)')
+
+
+def simplify_stroke_dasharray_style(element, name, value):
+    if value != 'none':
+        value = ' '.join(map(
+            lambda s: f'{check_round(float(s), 0.2):.1f}', value.split(',')))
+        element.set(name, f'{value}')
+
+
+def simplify_stroke_width_style(element, name, value):
+    value = check_round(float(value), 0.2)
+    if value != 0.2:
+        element.set(name, f'{value:.1f}')
+
+
+style_simplify_functions = {
+    'fill': keep_style_unless('#000000'),
+    'fill-opacity': keep_style_unless('1'),
+    'font-family': require_style("'Fira Sans'"),
+    'font-stretch': require_style('normal'),
+    'font-style': require_style('normal'),
+    'font-variant': require_style('normal'),
+    'font-weight': require_style('normal'),
+    'font-size': simplify_font_size_style,
+    'marker-start': simplify_marker_style,
+    'marker-end': simplify_marker_style,
+    'stroke': keep_style_unless('none'),
+    'stroke-dasharray': simplify_stroke_dasharray_style,
+    'stroke-dashoffset': ignore_style,
+    'stroke-linecap': keep_style_unless('butt'),
+    'stroke-linejoin': keep_style_unless('miter'),
+    'stroke-opacity': require_style('1'),
+    'stroke-width': simplify_stroke_width_style,
+    'text-align': ignore_style,
+    'text-anchor': keep_style_unless('start'),
+    'stop-color': ignore_style,
+}
+
+
 def simplify_attributes(element, valid_keys):
     attributes = element.attrib
-    for key, value in element.items():
+    # Coordinates and sizes of rotated elements are not rounded.
+    rotated = element.get('transform') in ROTATIONS
+    for key, value in list(attributes.items()):
         if not key in valid_keys:
             if not key in {'id', 'style'} and not ':' in key:
                 raise NotImplementedError(key)
@@ -81,76 +168,22 @@ def simplify_attributes(element, valid_keys):
         elif key == 'd':
             element.set(key, simplify_path_data(value))
         elif key == 'style':
+            # A property can appear several times (see simplify_text), and each
+            # occurrence must be simplified, in order.
             for style_element in value.split(';'):
                 name_value = style_element.split(':')
                 name = name_value[0]
                 value = name_value[1]
-                match name:
-                    case 'fill':
-                        if value != '#000000':
-                            element.set(name, value)
-                    case 'fill-opacity':
-                        if value != '1':
-                            element.set(name, value)
-                    case 'font-family':
-                        if value != "'Fira Sans'":
-                            raise NotImplementedError(name, value)
-                    case 'font-stretch' | 'font-variant' | 'font-weight' | 'font-style':
-                        if value != 'normal':
-                            raise NotImplementedError(name, value)
-                    case 'font-size':
-                        value = float(value.removesuffix('px'))
-                        if value != 3.9:
-                            element.set(name, f'{value}px')
-                    case 'marker-start':
-                        element.set(name, 'url(#arrow)')
-                    case 'marker-end':
-                        element.set(name, 'url(#arrow)')
-                    case 'stroke':
-                        if value != 'none':
-                            element.set(name, f'{value}')
-                    case 'stroke-dasharray':
-                        if value != 'none':
-                            value = ' '.join(map(
-                                lambda s: f'{check_round(float(s), 0.2):.1f}',
-                                value.split(',')))
-                            element.set(name, f'{value}')
-                    case 'stroke-dashoffset':
-                        continue
-                    case 'stroke-linecap':
-                        if value != 'butt':
-                            element.set(name, f'{value}')
-                    case 'stroke-linejoin':
-                        if value != 'miter':
-                            element.set(name, f'{value}')
-                    case 'stroke-opacity':
-                        if value != '1':
-                            raise NotImplementedError(name, value)
-                    case 'stroke-width':
-                        value = check_round(float(value), 0.2)
-                        if value != 0.2:
-                            element.set(name, f'{value:.1f}')
-                    case 'text-align':
-                        continue
-                    case 'text-anchor':
-                        if value != 'start':
-                            element.set(name, value)
-                    case 'stop-color':
-                        continue
-                    case _:
-                        if not name.startswith('-'):
-                            raise NotImplementedError(name, value)
+                simplify_function = style_simplify_functions.get(name)
+                if simplify_function:
+                    simplify_function(element, name, value)
+                elif not name.startswith('-'):
+                    raise NotImplementedError(name, value)
             attributes.pop(key)
-        elif (key == 'fill' and value == '#000000') or (
-                key == 'fill-opacity' and value == '1') or (
-                key == 'stroke' and value == 'none') or (
-                key == 'stroke-opacity' and value == '1') or (
-                key == 'text-anchor' and value == 'start'):
+        elif (key, value) in DEFAULT_ATTRIBUTES:
             attributes.pop(key)
-        elif key in {'x', 'y', 'width', 'height', 'cx', 'cy', 'rx', 'ry', 'r'}:
-            if 'transform' in element.keys() and (
-                    element.get('transform') == 'rotate(-45)' or
-                    element.get('transform') == 'rotate(45)'):
+        elif key in GEOMETRY_KEYS:
+            if rotated:
                 continue
             if value.endswith('mm'):
                 element.set(
@@ -196,25 +229,27 @@ def simplify_text(element):
                                   'text-anchor', 'transform', 'x', 'y'})
 
 
+group_child_simplify_functions = {
+    consts.CIRCLE: simplify_circle,
+    consts.PATH: simplify_path,
+    consts.RECT: simplify_rect,
+    consts.TEXT: simplify_text,
+}
+
+
 def simplify_group(element):
     simplify_attributes(element, {'font-family', 'font-size', 'stroke-width'})
     element.set('font-family', "'Fira Sans'")
     element.set('font-size', '3.9px')
     element.set('stroke-width', '0.2')
     for child in list(element):
-        match child.tag:
-            case consts.CIRCLE:
-                simplify_circle(child)
-            case consts.PATH:
-                simplify_path(child)
-            case consts.RECT:
-                simplify_rect(child)
-            case consts.TEXT:
-                simplify_text(child)
-            case _:
-                if child.tag.startswith(consts.SVG_NAMESPACE):
-                    raise NotImplementedError(child.tag)
-                element.remove(child)
+        simplify_function = group_child_simplify_functions.get(child.tag)
+        if simplify_function:
+            simplify_function(child)
+        elif child.tag.startswith(consts.SVG_NAMESPACE):
+            raise NotImplementedError(child.tag)
+        else:
+            element.remove(child)
 
 
 def simplify_marker(element):
@@ -296,7 +331,7 @@ def convert_style(element, remove_fill=False):
             angle = 180
             styles.append(f'rotate=180')
         else:
-            angle = -int(re.search('rotate\((-?\d*)\)', transform).group(1))
+            angle = -int(ROTATE_REGEX.search(transform).group(1))
             styles.append(f'rotate={angle}')
     if stroke := element.get('stroke'):
         styles.append(f'draw={convert_color(stroke)}')
@@ -357,60 +392,63 @@ def convert_style(element, remove_fill=False):
 
 
 def convert_path(path):
-    result = ''
+    result = []
     size = 0
     tokens = path.split(' ')
     command = None
+    kind = None
+    absolute = False
     (x, y) = (0, 0)
     control = 0
     for token in tokens:
         if len(token) == 1 and token[0].isalpha():
             command = token
+            kind = COMMAND_KINDS.get(command)
+            absolute = command.isupper()
             control = 0
             if command == 'Z' or command == 'z':
-                result += ' -- cycle'
+                result.append(' -- cycle')
             continue
-        match command:
-            case 'M' | 'm' | 'L' | 'l' | 'C' | 'c':
-                coords = token.split(',')
-                dx, dy = float(coords[0]), float(coords[1])
-                if command.isupper():
-                    x, y = dx, dy
-                elif command != 'c':
-                    x += dx
-                    y += dy
-            case 'H' | 'h':
-                dx = float(token)
-                if command.isupper():
-                    x = dx
-                else:
-                    x += dx
-            case 'V' | 'v':
-                dy = float(token)
-                if command.isupper():
-                    y = dy
-                else:
-                    y += dy
-            case _:
-                raise NotImplementedError(path)
+        if kind == POINT:
+            coords = token.split(',')
+            dx, dy = float(coords[0]), float(coords[1])
+            if absolute:
+                x, y = dx, dy
+            elif command != 'c':
+                x += dx
+                y += dy
+        elif kind == HORIZONTAL:
+            dx = float(token)
+            if absolute:
+                x = dx
+            else:
+                x += dx
+        elif kind == VERTICAL:
+            dy = float(token)
+            if absolute:
+                y = dy
+            else:
+                y += dy
+        else:
+            raise NotImplementedError(path)
         if command == 'C':
             match control:
                 case 0:
-                    result += f' .. controls ({format(x)},{format(y)})'
+                    result.append(f' .. controls ({format(x)},{format(y)})')
                 case 1:
-                    result += f' and ({format(x)},{format(y)})'
+                    result.append(f' and ({format(x)},{format(y)})')
                 case _:
-                    result += f' .. ({format(x)},{format(y)})'
+                    result.append(f' .. ({format(x)},{format(y)})')
             control = (control + 1) % 3
             size += 1
         elif command == 'c':
             match control:
                 case 0:
-                    result += f' .. controls ({format(x+dx)},{format(y+dy)})'
+                    result.append(f' .. controls ({format(x+dx)},{format(y+dy)})')
                 case 1:
-                    result += f' and ({format(x+dx)},{format(y+dy)})'
+                    result.append(f' and ({format(x+dx)},{format(y+dy)})')
                 case _:
-                    result += f' .. ({format(x+dx)},{format(y+dy)})'
+                    result.append(f' .. ({format(x+dx)},{format(y+dy)})')
             control = (control + 1) % 3
             size += 1
             if control == 0:
@@ -421,46 +459,70 @@ def convert_path(path):
             elif command == 'm':
                 command = 'l'
             else:
-                result += ' -- '
-            result += f'({format(x)},{format(y)})'
+                result.append(' -- ')
+            result.append(f'({format(x)},{format(y)})')
             size += 1
-    return (result, size)
+    return (''.join(result), size)
+
+
+# Returns the cosine and sine of an angle in degrees. There are only a few
+# distinct text angles, so the results are cached.
+@lru_cache(maxsize=16)
+def cos_sin(angle):
+    angle = math.radians(angle)
+    return (math.cos(angle), math.sin(angle))
 
 
 def convert_svg(element):
-    tikz = ''
-    for child in list(element):
+    tikz = []
+    for child in element.iterchildren():
         match child.tag:
             case consts.GROUP:
-                tikz += convert_svg(child)
+                tikz.append(convert_svg(child))
             case consts.CIRCLE:
                 x = child.get('cx')
                 y = child.get('cy')
                 r = child.get('r')
                 style, angle = convert_style(child)
-                tikz += f'\\path[{style}] ({x},{y}) circle[radius={r}];\n'
+                tikz.append(f'\\path[{style}] ({x},{y}) circle[radius={r}];\n')
             case consts.PATH:
                 path = child.get('d')
                 coords, size = convert_path(path)
                 style, angle = convert_style(child, size == 2)
-                tikz += f'\\path[{style}] {coords};\n'
+                tikz.append(f'\\path[{style}] {coords};\n')
             case consts.RECT:
                 x = child.get('x')
                 y = child.get('y')
                 width = child.get('width')
                 height = child.get('height')
                 style, angle = convert_style(child)
-                tikz += f'\\path[{style}] ({x},{y}) rectangle +({width},{height});\n'
+                tikz.append(f'\\path[{style}] ({x},{y}) rectangle +({width},{height});\n')
             case consts.TEXT:
                 x = float(child.get('x'))
                 y = float(child.get('y'))
                 style, angle = convert_style(child)
-                angle = math.radians(angle)
-                rx = x * math.cos(angle) + y * math.sin(angle)
-                ry = x * math.sin(angle) - y * math.cos(angle)
-                tikz += f'\\node[{style}] at ({format(rx)},{format(-ry)}){{{child.text}}};\n'
-    return tikz
+                cos, sin = cos_sin(angle)
+                rx = x * cos + y * sin
+                ry = x * sin - y * cos
+                tikz.append(f'\\node[{style}] at ({format(rx)},{format(-ry)}){{{child.text}}};\n')
+    return ''.join(tikz)
+
+
+SVG_HEADER = '''<!--
+This work is licensed under the Creative Commons Attribution NonCommercial
+ShareAlike 4.0 International License. To view a copy of the license, visit
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+-->
+'''
+
+TIKZ_HEADER = '''\
+% This work is licensed under the Creative Commons Attribution NonCommercial
+% ShareAlike 4.0 International License. To view a copy of the license, visit
+% https://creativecommons.org/licenses/by-nc-sa/4.0/
+\\begin{tikzpicture}[x=0.8mm,y=-0.8mm,inner sep=0pt,outer sep=0pt,line width=0.2mm]
+'''
 
+TIKZ_FOOTER = '\\end{tikzpicture}\n'
 
 src = open(sys.argv[1], "rb")
 tree = etree.parse(src, parser=etree.XMLParser(remove_comments=True))
@@ -469,25 +531,13 @@ simplify_svg(tree.getroot())
 tikz = convert_svg(tree.getroot())
 etree.cleanup_namespaces(tree)
 
-dst = open(sys.argv[1], "w")
-dst.write('<!--\n')
-dst.write(
-    'This work is licensed under the Creative Commons Attribution NonCommercial\n')
-dst.write(
-    'ShareAlike 4.0 International License. To view a copy of the license, visit\n')
-dst.write('https://creativecommons.org/licenses/by-nc-sa/4.0/\n')
-dst.write('-->\n')
-dst.write(etree.tostring(tree, pretty_print=True).decode())
+# Stream the simplified SVG to the file instead of serializing it to a string.
+dst = open(sys.argv[1], "wb")
+dst.write(SVG_HEADER.encode())
+with etree.xmlfile(dst) as xml_file:
+    xml_file.write(tree.getroot(), pretty_print=True)
 dst.close()
 
 dst = open(sys.argv[2], "w")
-dst.write(
-    '% This work is licensed under the Creative Commons Attribution NonCommercial\n')
-dst.write(
-    '% ShareAlike 4.0 International License. To view a copy of the license, visit\n')
-dst.write('% https://creativecommons.org/licenses/by-nc-sa/4.0/\n')
-dst.write(
-    '\\begin{tikzpicture}[x=0.8mm,y=-0.8mm,inner sep=0pt,outer sep=0pt,line width=0.2mm]\n')
-dst.write(tikz)
-dst.write('\\end{tikzpicture}\n')
+dst.write(TIKZ_HEADER + tikz + TIKZ_FOOTER)
 dst.close()
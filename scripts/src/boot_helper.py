@@ -12,37 +12,64 @@
 
 import serial
 
-# Initialize the serial port to communicate with the SAM-BA program,
-# as described in section 20.4.1 of the SAM3X / SAM3A Datasheet.
-try:
-	serial_port = serial.Serial(port='/dev/ttyACM0', baudrate=115200,
-								parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
-								bytesize=serial.EIGHTBITS, timeout=5, write_timeout=1)
-except:
-	exit('ERROR: could not open serial port.')
+# The serial port, opened by init().
+serial_port = None
 
 
 def run(command, verbose=False):
 	serial_port.write(bytearray(command.encode('ascii')))
 	if command.endswith('#'):
-		bytes = bytearray()
-		while True:
-			byte = serial_port.read()
-			if len(byte) != 1:
-				exit('ERROR: no response from device.')
-			if chr(byte[0]) == '>':
-				result = bytes.decode('ascii').lstrip()
-				if verbose:
-					print(f'{result}>', end='')
-				return result
-			bytes.append(byte[0])
-
-
-# Flush the connection and switch the SAM-BA Monitor to ASCII mode.
-serial_port.flush()
-run('T#', verbose=True)
+		data = serial_port.read_until(b'>')
+		if not data.endswith(b'>'):
+			exit('ERROR: no response from device.')
+		result = data[:-1].decode('ascii').lstrip()
+		if verbose:
+			print(f'{result}>', end='')
+		return result
+
+
+# Sends the given commands and returns their responses. Each command must end
+# with '#'. At most max_in_flight commands are sent before their response is
+# received: the SAM-BA Monitor reads the serial line by polling, and can lose
+# the bytes received while it sends a response. Only use a larger value after
+# testing it with a real board.
+def run_batch(commands, max_in_flight=1):
+	results = []
+	sent = 0
+	while len(results) < len(commands):
+		while sent < len(commands) and sent - len(results) < max_in_flight:
+			serial_port.write(commands[sent].encode('ascii'))
+			sent += 1
+		data = serial_port.read_until(b'>')
+		if not data.endswith(b'>'):
+			exit('ERROR: no response from device.')
+		results.append(data[:-1].decode('ascii').lstrip())
+	return results
+
+
+# Initializes the serial port to communicate with the SAM-BA program, as
+# described in section 20.4.1 of the SAM3X / SAM3A Datasheet, flushes the
+# connection and switches the SAM-BA Monitor to ASCII mode.
+def init(port='/dev/ttyACM0'):
+	global serial_port
+	try:
+		serial_port = serial.Serial(port=port, baudrate=115200,
+									parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+									bytesize=serial.EIGHTBITS, timeout=5, write_timeout=1)
+	except:
+		exit('ERROR: could not open serial port.')
+	# Use a large receive buffer for the batched commands (this is only
+	# supported on Windows, Linux buffers are already large enough).
+	try:
+		serial_port.set_buffer_size(rx_size=65536)
+	except AttributeError:
+		pass
+	serial_port.flush()
+	run('T#', verbose=True)
+
 
 if __name__ == '__main__':
+	init()
 	# Main loop (read commands from stdin, run them).
 	while True:
 		try:
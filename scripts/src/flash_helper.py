@@ -18,6 +18,9 @@ import boot_helper
 # Check if stdin is a file. If not, we assume it is an interactive terminal.
 stdin_from_file = stat.S_ISREG(os.fstat(0).st_mode)
 
+# Matches the SAM-BA write word commands, 'Waddress,value#'.
+WRITE_REGEX = re.compile(r"W([0-9A-Fa-f]{1,8}),([0-9A-Fa-f]{1,8})#")
+
 
 def wait_ready(register):
 	while boot_helper.run(f'w{register:08X},#').strip() != '0x00000001':
@@ -25,19 +28,28 @@ def wait_ready(register):
 
 
 class Page:
-	def __init__(self, index):
+	# If assume_erased is True the page is not read from the device, and is
+	# assumed to contain only 0xFFFFFFFF words (flashing it then erases the
+	# words which are not explicitly set).
+	def __init__(self, index, assume_erased=False):
 		self._index = index
 		self._address = index * 256 + 0x80000
-		self._values = []
 		self._dirty = False
+		if assume_erased:
+			self._values = ['FFFFFFFF'] * 64
+			return
 		print(f'Reading page {self._index}...', end='')
-		for i in range(0, 64):
-			address = self._address + 4 * i
-			value = boot_helper.run(f'w{address:08X},#').strip()
-			self._values.append(value[2:])
+		self._values = self._read_values()
 		print(' Done.')
 
+	# Returns the words of the page, as 8 digits uppercase hex strings.
+	def _read_values(self):
+		commands = [f'w{self._address + 4 * i:08X},#' for i in range(0, 64)]
+		return [value.strip()[2:].upper()
+				for value in boot_helper.run_batch(commands)]
+
 	def set(self, index, value):
+		value = f'{int(value, 16):08X}'
 		if value != self._values[index]:
 			self._values[index] = value
 			self._dirty = True
@@ -46,9 +58,9 @@ class Page:
 		if not self._dirty:
 			return
 		print(f'Writing page {self._index}...', end='')
-		for i in range(0, 64):
-			address, value = self._address + 4 * i, self._values[i]
-			boot_helper.run(f'W{address:08X},{value}#')
+		commands = [f'W{self._address + 4 * i:08X},{value}#'
+					for i, value in enumerate(self._values)]
+		boot_helper.run_batch(commands)
 		if self._index < 1024:
 			command = 0x5A000003 | (self._index << 8)
 			boot_helper.run(f'W400E0A04,{command:08X}#')
@@ -57,16 +69,18 @@ class Page:
 			command = 0x5A000003 | ((self._index - 1024) << 8)
 			boot_helper.run(f'W400E0C04,{command:08X}#')
 			wait_ready(0x400E0C08)
-		for i in range(0, 64):
-			address = self._address + 4 * i
-			value = boot_helper.run(f'w{address:08X},#').strip()[2:]
-			if int(value, 16) != int(self._values[i], 16):
+		for i, value in enumerate(self._read_values()):
+			if value != self._values[i]:
+				address = self._address + 4 * i
 				exit(f'ERROR: page write failed at address {address:08X}')
 		print(' Done.')
 
 
+boot_helper.init()
+
 # Main loop (read commands from stdin, run them).
 pages = {}
+assume_erased = False
 while True:
 	try:
 		commands = input().replace('#', '#\n').split()
@@ -84,13 +98,23 @@ while True:
 			pages = {}
 			print('>', end='')
 			continue
+		if command == 'flash_clean#':
+			assume_erased = True
+			print('Assuming erased pages (unset words are written as FFFFFFFF).')
+			print('>', end='')
+			continue
+		if command == 'flash_read#':
+			assume_erased = False
+			print('Reading pages before modifying them.')
+			print('>', end='')
+			continue
 		if command == 'reset#':
 			boot_helper.run('W400E0A04,5A00010B#')  # Set boot from flash.
 			wait_ready(0x400E0A08)
 			reset = 'W400E1A00,A500000D#'
 			boot_helper.serial_port.write(bytearray(reset.encode('ascii')))
 			exit()
-		match = re.match(r"W([0-9A-Fa-f]{1,8}),([0-9A-Fa-f]{1,8})#", command)
+		match = WRITE_REGEX.match(command)
 		if match:
 			address, value = int(match.group(1), 16), match.group(2)
 			if address >= 0x80000 and address < 0x100000:
@@ -98,7 +122,7 @@ while True:
 					exit(f'ERROR: invalid address {address}.')
 				page, word = (address - 0x80000) // 256, (address % 256) // 4
 				if page not in pages:
-					pages[page] = Page(page)
+					pages[page] = Page(page, assume_erased)
 				pages[page].set(word, value)
 				if not stdin_from_file:
 					print('>', end='')
@@ -52,8 +52,12 @@ struct Page {
 }
 
 impl Page {
+    // If assume_erased is true the page is not read from the device, and is
+    // assumed to contain only 0xFFFFFFFF words (flashing it then erases the
+    // words which are not explicitly set).
     fn new(
         index: u32,
+        assume_erased: bool,
         serial_port: &RefCell<SerialPort>,
         output: &mut String,
     ) -> Result<Self, String> {
@@ -63,6 +67,10 @@ impl Page {
             values: [0; FLASH_PAGE_WORDS as usize],
             dirty: false,
         };
+        if assume_erased {
+            page.values = [0xFFFFFFFF; FLASH_PAGE_WORDS as usize];
+            return Ok(page);
+        }
         output.push_str(format!("Reading page {}...", page.index).as_str());
         for i in 0..FLASH_PAGE_WORDS {
             let address = page.address + 4 * i;
@@ -122,6 +130,7 @@ pub struct FlashHelper<'a> {
     input_from_file: bool,
     terminal: bool,
     pages: BTreeMap<u32, Box<Page>>,
+    assume_erased: bool,
     output: String,
 }
 
@@ -136,6 +145,7 @@ impl<'a> FlashHelper<'a> {
             input_from_file: false,
             terminal,
             pages: BTreeMap::<u32, Box<Page>>::default(),
+            assume_erased: false,
             output: if terminal {
                 String::from("")
             } else {
@@ -154,6 +164,7 @@ impl<'a> FlashHelper<'a> {
             input_from_file: true,
             terminal,
             pages: BTreeMap::<u32, Box<Page>>::default(),
+            assume_erased: false,
             output: if terminal {
                 String::from("")
             } else {
@@ -204,6 +215,18 @@ impl<'a> FlashHelper<'a> {
                 self.output.push('>');
                 continue;
             }
+            if command.trim() == "flash_clean#" {
+                self.assume_erased = true;
+                self.output
+                    .push_str("Assuming erased pages (unset words are written as FFFFFFFF).\n>");
+                continue;
+            }
+            if command.trim() == "flash_read#" {
+                self.assume_erased = false;
+                self.output
+                    .push_str("Reading pages before modifying them.\n>");
+                continue;
+            }
             if command.trim() == "reset#" {
                 run(self.serial_port, "W400E0A04,5A00010B#")?; // Set boot from flash.
                 wait_ready(self.serial_port, 0x400E0A08)?;
@@ -220,7 +243,12 @@ impl<'a> FlashHelper<'a> {
                 if let Some(page) = self.pages.get_mut(&page_index) {
                     page.set(word_index, value);
                 } else {
-                    let mut page = Page::new(page_index, self.serial_port, &mut self.output)?;
+                    let mut page = Page::new(
+                        page_index,
+                        self.assume_erased,
+                        self.serial_port,
+                        &mut self.output,
+                    )?;
                     page.set(word_index, value);
                     self.pages.insert(page_index, Box::new(page));
                 }
@@ -333,4 +361,44 @@ mod tests {
             >exit#"
         );
     }
+
+    #[test]
+    fn flash_clean_page() {
+        let controller = RefCell::new(MicroController::default());
+        let mut flash_helper = FlashHelper::new(&controller);
+
+        flash_helper.write("W00080114,DECACAFE#");
+        flash_helper.write("flash#");
+        flash_helper.write("flash_clean#");
+        flash_helper.write("W00080118,DECA1234#");
+        flash_helper.write("flash#");
+        flash_helper.write("w00080114,#");
+        flash_helper.write("w00080118,#");
+        flash_helper.write("flash_read#");
+        flash_helper.write("W00080118,CAFEBABE#");
+        flash_helper.write("exit#");
+
+        assert_eq!(
+            flash_helper.read(),
+            "user@host:~$ python3 flash_helper.py\n\
+            >W00080114,DECACAFE#\n\
+            Reading page 1... Done.\n\
+            >flash#\n\
+            Writing page 1... Done.\n\
+            >flash_clean#\n\
+            Assuming erased pages (unset words are written as FFFFFFFF).\n\
+            >W00080118,DECA1234#\n\
+            >flash#\n\
+            Writing page 1... Done.\n\
+            >w00080114,#\n\
+            0xFFFFFFFF\n\
+            >w00080118,#\n\
+            0xDECA1234\n\
+            >flash_read#\n\
+            Reading pages before modifying them.\n\
+            >W00080118,CAFEBABE#\n\
+            Reading page 1... Done.\n\
+            >exit#"
+        );
+    }
 }